@@ -2,10 +2,19 @@ import streamlit as st
 import os
 import sys
 import traceback
-import tempfile
 import sqlite3
+import hashlib
+import re
+import wave
+import threading
+import queue
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import bcrypt
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+import requests
 from dotenv import load_dotenv
 from gtts import gTTS
 from groq import Groq
@@ -13,10 +22,10 @@ from langgraph.prebuilt import create_react_agent
 from langchain_groq import ChatGroq
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain.chains.summarize import load_summarize_chain
-from langchain_community.document_loaders import PyPDFLoader
+from langchain_core.documents import Document
 from langchain_community.tools import ArxivQueryRun, WikipediaQueryRun, DuckDuckGoSearchRun
 from langchain_community.utilities import ArxivAPIWrapper, WikipediaAPIWrapper
-import puremagic
+import pymupdf
 import os
 from dotenv import load_dotenv
 
@@ -40,64 +49,151 @@ if not groq_api_key:
 # -------------------------------
 # Database Setup
 # -------------------------------
+# Queries are kept as constants so each call sends identical SQL text and
+# hits the connection's prepared-statement cache instead of re-parsing.
+INSERT_USER_SQL = "INSERT INTO users (username, password) VALUES (?, ?)"
+SELECT_USER_SQL = "SELECT id, password FROM users WHERE username = ?"
+UPDATE_USER_PASSWORD_SQL = "UPDATE users SET password = ? WHERE id = ?"
+INSERT_PODCAST_SQL = "INSERT INTO podcasts (user_id, title, summary, audio_path) VALUES (?, ?, ?, ?)"
+SELECT_USER_PODCASTS_SQL = "SELECT title, summary, audio_path, created_at FROM podcasts WHERE user_id = ? ORDER BY created_at DESC"
+
+def open_connection(**kwargs):
+    """Open a SQLite connection with the app's pragmas applied"""
+    # isolation_level=None puts sqlite3 in autocommit mode; writes manage
+    # their own transactions through db_write() below.
+    conn = sqlite3.connect(DB_FILE, isolation_level=None, cached_statements=256, **kwargs)
+    conn.set_trace_callback(None)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-20000")  # ~20 MB page cache
+    return conn
+
+@st.cache_resource(show_spinner=False)
+def get_db():
+    """Open the shared write connection (WAL mode) and its write lock"""
+    conn = open_connection(check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn, threading.Lock()
+
+READ_POOL_SIZE = 4
+
+@st.cache_resource(show_spinner=False)
+def get_read_pool():
+    """Open a process-wide pool of read connections, shared across reruns"""
+    pool = queue.Queue()
+    for _ in range(READ_POOL_SIZE):
+        pool.put(open_connection(check_same_thread=False))
+    return pool
+
+@contextmanager
+def db_read():
+    """
+    Check out a read connection from the pool. Reads never touch the
+    shared write connection, so they can't see another session's
+    uncommitted rows, and under WAL they run alongside writes.
+    """
+    pool = get_read_pool()
+    conn = pool.get()
+    try:
+        yield conn.cursor()
+    finally:
+        pool.put(conn)
+
+@contextmanager
+def db_write():
+    """Run a write in a single transaction, serialized across sessions"""
+    conn, lock = get_db()
+    with lock:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            yield cursor
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        else:
+            cursor.execute("COMMIT")
+
 def init_database():
     """Initialize SQLite database with required tables"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # Users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Podcasts table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS podcasts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            title TEXT NOT NULL,
-            summary TEXT NOT NULL,
-            audio_path TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    with db_write() as cursor:
+        # Users table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                password TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Podcasts table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS podcasts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                title TEXT NOT NULL,
+                summary TEXT NOT NULL,
+                audio_path TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+        
+        # History lookups filter by user and sort newest first. users.username
+        # needs no extra index: its UNIQUE constraint already creates one.
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_podcasts_user_created
+            ON podcasts (user_id, created_at DESC)
+        ''')
+
+@st.cache_resource(show_spinner=False)
+def ensure_database():
+    """Run init_database() once and share the result across sessions"""
+    init_database()
+    return True
 
 # -------------------------------
 # User Management Functions
 # -------------------------------
+# New passwords are hashed with argon2id; bcrypt is only kept to verify
+# accounts created before the switch, which are rehashed on login.
+PASSWORD_HASHER = PasswordHasher(time_cost=2, memory_cost=65536, parallelism=1)
+BCRYPT_PREFIXES = ("$2a$", "$2b$", "$2y$")
+
+@st.cache_resource(show_spinner=False)
+def get_hash_pool():
+    """Shared worker pool for password hashing (both KDFs release the GIL)"""
+    return ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+
 def hash_password(password):
-    """Hash a password using bcrypt"""
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
-    return hashed.decode('utf-8')
+    """Hash a password using argon2id"""
+    return get_hash_pool().submit(PASSWORD_HASHER.hash, password).result()
 
 def verify_password(password, hashed_password):
-    """Verify a password against its hash"""
-    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+    """Verify a password against its argon2id (or legacy bcrypt) hash"""
+    if hashed_password.startswith(BCRYPT_PREFIXES):
+        return get_hash_pool().submit(
+            bcrypt.checkpw, password.encode('utf-8'), hashed_password.encode('utf-8')
+        ).result()
+    try:
+        return get_hash_pool().submit(PASSWORD_HASHER.verify, hashed_password, password).result()
+    except (VerificationError, InvalidHashError):
+        return False
+
+def password_needs_rehash(hashed_password):
+    """True for legacy bcrypt hashes and argon2 hashes with outdated parameters"""
+    return (
+        hashed_password.startswith(BCRYPT_PREFIXES)
+        or PASSWORD_HASHER.check_needs_rehash(hashed_password)
+    )
 
 def register_user(username, password):
     """Register a new user in the database"""
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        
         hashed_pw = hash_password(password)
-        cursor.execute(
-            "INSERT INTO users (username, password) VALUES (?, ?)",
-            (username, hashed_pw)
-        )
-        
-        conn.commit()
-        conn.close()
+        with db_write() as cursor:
+            cursor.execute(INSERT_USER_SQL, (username, hashed_pw))
         return True, "Registration successful"
     except sqlite3.IntegrityError:
         return False, "Username already exists"
@@ -106,50 +202,51 @@ def register_user(username, password):
 
 def authenticate_user(username, password):
     """Authenticate a user"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT id, password FROM users WHERE username = ?", (username,))
-    result = cursor.fetchone()
-    conn.close()
+    with db_read() as cursor:
+        cursor.execute(SELECT_USER_SQL, (username,))
+        result = cursor.fetchone()
     
     if result and verify_password(password, result[1]):
+        if password_needs_rehash(result[1]):
+            # Upgrade the stored hash now that we know the plaintext
+            new_hash = hash_password(password)
+            try:
+                with db_write() as cursor:
+                    cursor.execute(UPDATE_USER_PASSWORD_SQL, (new_hash, result[0]))
+            except sqlite3.Error:
+                pass  # Keep the old hash; login still succeeds
         return True, result[0]  # Return user_id
     return False, None
 
 # -------------------------------
 # Podcast Management Functions
 # -------------------------------
-def save_podcast(user_id, title, summary, audio_path):
-    """Save podcast to database"""
+def save_podcasts_bulk(rows):
+    """Save several (user_id, title, summary, audio_path) rows in one transaction"""
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "INSERT INTO podcasts (user_id, title, summary, audio_path) VALUES (?, ?, ?, ?)",
-            (user_id, title, summary, audio_path)
-        )
-        
-        conn.commit()
-        conn.close()
+        with db_write() as cursor:
+            cursor.executemany(INSERT_PODCAST_SQL, rows)
+        # The history cache is shared by every session, so drop it for all
+        # of them; a per-session counter can't tell sessions apart
+        get_user_podcasts.clear()
         return True
     except Exception as e:
         st.error(f"Error saving podcast: {str(e)}")
         return False
 
+def save_podcast(user_id, title, summary, audio_path):
+    """Save podcast to database"""
+    return save_podcasts_bulk([(user_id, title, summary, audio_path)])
+
+@st.cache_data(ttl=60, show_spinner=False)
 def get_user_podcasts(user_id):
-    """Retrieve all podcasts for a user"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        "SELECT title, summary, audio_path, created_at FROM podcasts WHERE user_id = ? ORDER BY created_at DESC",
-        (user_id,)
-    )
-    
-    results = cursor.fetchall()
-    conn.close()
+    """
+    Retrieve all podcasts for a user. Results are cached until the next
+    save (which clears the cache) or for at most 60 seconds.
+    """
+    with db_read() as cursor:
+        cursor.execute(SELECT_USER_PODCASTS_SQL, (user_id,))
+        results = cursor.fetchall()
     
     return [
         {
@@ -162,26 +259,19 @@ def get_user_podcasts(user_id):
     ]
 
 # -------------------------------
-# File type detection (pure-Python, no libmagic system dependency)
+# File type detection (header sniff, no magic database needed)
 # -------------------------------
 def detect_mime_type(file_bytes, filename):
     """
-    Detect MIME type using puremagic (content sniffing), with an
-    extension-based fallback if puremagic can't confidently identify it.
+    Detect MIME type for the two accepted upload types: PDFs by their
+    %PDF- signature, text files by extension plus a prefix with no NUL
+    bytes (binary files almost always contain some).
     """
-    try:
-        matches = puremagic.magic_string(file_bytes)
-        if matches:
-            # matches are sorted by confidence, take the best guess
-            return matches[0].mime_type
-    except Exception:
-        pass
+    if file_bytes.startswith(b"%PDF-"):
+        return "application/pdf"
 
-    # Fallback: infer from extension
     ext = os.path.splitext(filename)[1].lower()
-    if ext == ".pdf":
-        return "application/pdf"
-    if ext == ".txt":
+    if ext == ".txt" and b"\x00" not in file_bytes:
         return "text/plain"
     return "application/octet-stream"
 
@@ -224,30 +314,278 @@ def sanitize_text(text):
     return text
 
 
+# -------------------------------
+# Summarization
+# -------------------------------
+@st.cache_resource(show_spinner=False)
+def get_splitter():
+    """Shared text splitter, built once instead of per generation"""
+    return RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=200)
+
+# Same prompt load_summarize_chain uses for its map and combine steps
+SUMMARY_PROMPT = 'Write a concise summary of the following:\n\n\n"{text}"\n\n\nCONCISE SUMMARY:'
+MAP_CONCURRENCY = 8
+# Same bound load_summarize_chain's collapse step used: partial summaries
+# are merged in groups of at most this many tokens until they fit in one
+# reduce prompt. Tokens are estimated at ~4 characters each.
+REDUCE_TOKEN_MAX = 3000
+
+def estimate_tokens(text):
+    """Rough token count, without needing a tokenizer"""
+    return len(text) // 4
+
+def group_by_tokens(texts, token_max=REDUCE_TOKEN_MAX):
+    """Greedily group consecutive texts so each group fits in token_max"""
+    groups = []
+    current = []
+    size = 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if current and size + tokens > token_max:
+            groups.append(current)
+            current = []
+            size = 0
+        current.append(text)
+        size += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+def summarize_batch(llm, texts):
+    """Summarize each text concurrently and return the summaries in order"""
+    prompts = [SUMMARY_PROMPT.format(text=text) for text in texts]
+    results = llm.batch(prompts, config={"max_concurrency": MAP_CONCURRENCY})
+    return [result.content for result in results]
+
+def map_reduce_summarize(llm, chunks):
+    """
+    Summarize each chunk concurrently (map), collapse the partial summaries
+    in token-bounded groups until they fit in one prompt, then summarize
+    them in a single call (reduce).
+    """
+    partials = summarize_batch(llm, [chunk.page_content for chunk in chunks])
+    while len(partials) > 1 and estimate_tokens("\n\n".join(partials)) > REDUCE_TOKEN_MAX:
+        groups = group_by_tokens(partials)
+        partials = summarize_batch(llm, ["\n\n".join(group) for group in groups])
+    combined = "\n\n".join(partials)
+    return llm.invoke(SUMMARY_PROMPT.format(text=combined)).content
+
+@st.cache_data(show_spinner=False, max_entries=100)
+def summarize_document(file_hash, filename, _file_bytes, _llm):
+    """
+    Load, split and summarize an uploaded document. Results are cached on
+    the SHA-256 of the file contents, so re-uploading the same file returns
+    its summary without calling the LLM again.
+    """
+    splitter = get_splitter()
+
+    # Load text and split it into chunks
+    if filename.endswith(".pdf"):
+        # Stream pages one at a time with MuPDF (several times faster than
+        # pure-Python pypdf) instead of joining the whole document into a
+        # single string first
+        chunks = []
+        word_count = 0
+        with pymupdf.open(stream=_file_bytes, filetype="pdf") as pdf:
+            for page in pdf:
+                # Sanitize: convert typographic punctuation (em dashes,
+                # smart quotes, etc. common in PDFs/resumes) and strip
+                # any other non-ASCII characters that could crash
+                # downstream libraries, before the text is split.
+                page_text = sanitize_text(page.get_text("text"))
+                word_count += len(page_text.split())
+                page_doc = Document(
+                    page_content=page_text,
+                    metadata={"source": filename, "page": page.number}
+                )
+                chunks.extend(splitter.split_documents([page_doc]))
+    else:
+        # Sanitized the same way as PDF pages, before splitting
+        text_content = sanitize_text(_file_bytes.decode("utf-8", errors="replace"))
+        chunks = splitter.create_documents([text_content])
+        word_count = len(text_content.split())
+
+    if word_count < 5000:
+        summarize_chain = load_summarize_chain(_llm, chain_type="stuff", verbose=False)
+        summary = summarize_chain.run(chunks)
+    else:
+        summary = map_reduce_summarize(_llm, chunks)
+
+    return sanitize_text(summary)
+
+# -------------------------------
+# Text-to-speech
+# -------------------------------
+TTS_CHUNK_CHARS = 700
+# Total Groq TTS requests in flight per podcast (the main-thread request
+# for chunk 1 included). Groq's TTS rate limit is low, so keep this small.
+TTS_MAX_CONCURRENCY = 2
+
+def clean_for_tts(text):
+    """
+    Strip markdown markup and repeated sentences from a summary before it
+    is synthesized; TTS time grows with input length and markup is either
+    read aloud or silently wasted.
+    """
+    text = re.sub(r"[*_`#>\[\]]", "", text)
+    text = re.sub(r"\s+", " ", text).strip()
+
+    sentences = []
+    for sentence in re.split(r"(?<=[.!?])\s+", text):
+        if not sentences or sentence != sentences[-1]:
+            sentences.append(sentence)
+    return " ".join(sentences)
+
+def split_for_tts(text, max_chars=TTS_CHUNK_CHARS):
+    """Split text at sentence boundaries into chunks of about max_chars"""
+    chunks = []
+    current = ""
+    for sentence in re.split(r"(?<=[.!?])\s+", text.strip()):
+        if current and len(current) + len(sentence) + 1 > max_chars:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}".strip()
+    if current:
+        chunks.append(current)
+    return chunks
+
+def generate_podcast_audio(client, text, output_path, voice="Celeste-PlayAI"):
+    """Synthesize text to a WAV file with Groq TTS"""
+    response = client.audio.speech.create(
+        model="playai-tts",
+        voice=voice,
+        input=text,
+        response_format="wav"
+    )
+    response.write_to_file(output_path)
+    return output_path
+
+def concat_wav_files(paths, output_path):
+    """Join WAV files that share the same format into a single file"""
+    try:
+        with wave.open(output_path, "wb") as out:
+            for i, path in enumerate(paths):
+                with wave.open(path, "rb") as src:
+                    if i == 0:
+                        out.setparams(src.getparams())
+                    out.writeframes(src.readframes(src.getnframes()))
+    except Exception:
+        # Don't leave a half-written podcast behind next to the gTTS fallback
+        if os.path.exists(output_path):
+            os.unlink(output_path)
+        raise
+    return output_path
+
+def synthesize_podcast(client, text, output_path, voice="Celeste-PlayAI"):
+    """
+    Synthesize a podcast progressively: the first chunk is played as soon
+    as it is ready while the remaining chunks are synthesized in the
+    background, then all chunks are joined into output_path.
+    """
+    text_chunks = split_for_tts(text)
+    if len(text_chunks) <= 1:
+        return generate_podcast_audio(client, text, output_path, voice)
+
+    base = os.path.splitext(output_path)[0]
+    chunk_paths = [f"{base}_{i}.wav" for i in range(1, len(text_chunks) + 1)]
+    pool = ThreadPoolExecutor(max_workers=max(TTS_MAX_CONCURRENCY - 1, 1))
+    try:
+        # Queue the rest first so they synthesize while chunk 1 plays
+        pending = [
+            pool.submit(generate_podcast_audio, client, chunk, path, voice)
+            for chunk, path in zip(text_chunks[1:], chunk_paths[1:])
+        ]
+        generate_podcast_audio(client, text_chunks[0], chunk_paths[0], voice)
+        st.caption("▶️ Preview (the full podcast is still being generated)")
+        st.audio(chunk_paths[0], autoplay=True)
+        for future in pending:
+            future.result()
+        pool.shutdown()
+        return concat_wav_files(chunk_paths, output_path)
+    except Exception:
+        # Drop queued chunks so the gTTS fallback starts without spending
+        # more TTS quota; only requests already in flight are waited for,
+        # so their chunk files exist before the cleanup below runs.
+        pool.shutdown(cancel_futures=True)
+        raise
+    finally:
+        for path in chunk_paths:
+            if os.path.exists(path):
+                os.unlink(path)
+
+# -------------------------------
+# Cached services (built once per API key, reused across reruns)
+# -------------------------------
+@st.cache_resource(show_spinner=False)
+def get_services(api_key):
+    """Build the LLM, Groq client and research tools for an API key"""
+    llm = ChatGroq(
+        model="openai/gpt-oss-120b",
+        groq_api_key=api_key,
+        streaming=True
+    )
+    client = Groq(api_key=api_key)
+
+    api_wiki = WikipediaAPIWrapper(top_k_results=1, doc_content_chars_max=250)
+    wiki = WikipediaQueryRun(api_wrapper=api_wiki)
+    api_arxiv = ArxivAPIWrapper(top_k_results=1, doc_content_chars_max=250)
+    arxiv = ArxivQueryRun(api_wrapper=api_arxiv)
+    search = DuckDuckGoSearchRun(name="search")
+    tools = [wiki, arxiv, search]
+
+    # The agent graph is identical for every chat turn, so compile it once
+    agent = create_react_agent(model=llm, tools=tools)
+
+    return {
+        "llm": llm,
+        "client": client,
+        "tools": tools,
+        "agent": agent,
+    }
+
+GROQ_MODELS_URL = "https://api.groq.com/openai/v1/models"
+
+@st.cache_data(ttl=300, show_spinner=False)
+def probe_api_key(api_key):
+    """
+    Return True if Groq accepts this API key, using a single lightweight
+    models-list request. Only 401/403 mean the key is invalid; network
+    errors and other failures (rate limits, outages) are raised, so they
+    are not cached.
+    """
+    response = requests.get(
+        GROQ_MODELS_URL,
+        headers={"Authorization": f"Bearer {api_key}"},
+        timeout=3
+    )
+    if response.status_code in (401, 403):
+        return False
+    response.raise_for_status()
+    return True
+
 def validate_api_key_callback():
     """Callback function to validate API key automatically"""
     api_key = st.session_state.api_key_input
     
-    if not api_key or len(api_key) < 10:
+    # Skip the network probe until the input looks like a complete Groq key
+    if not api_key or len(api_key) < 20 or not api_key.startswith("gsk_"):
         st.session_state.api_key_validated = False
-        st.session_state.validation_message = "⚠️ API key too short"
+        st.session_state.validation_message = "⚠️ API key too short or not a Groq key (gsk_...)"
         return
     
     try:
-        # Test the API key by initializing clients
-        test_client = Groq(api_key=api_key)
-        test_llm = ChatGroq(
-            model="openai/gpt-oss-120b",
-            groq_api_key=api_key,
-            streaming=True
-        )
-        
-        # If successful, update session state
+        valid = probe_api_key(api_key)
+    except requests.RequestException:
+        st.session_state.api_key_validated = False
+        st.session_state.validation_message = "⚠️ Could not reach Groq to validate the key, please try again"
+        return
+    
+    if valid:
         st.session_state.groq_api_key = api_key
         st.session_state.api_key_validated = True
         st.session_state.validation_message = "✅ API Key validated successfully!"
-        
-    except Exception as e:
+    else:
         st.session_state.api_key_validated = False
         st.session_state.groq_api_key = ""
         st.session_state.validation_message = "❌ Invalid API Key"
@@ -265,6 +603,8 @@ if "mes" not in st.session_state:
     st.session_state.mes = []
 if "session_podcasts" not in st.session_state:
     st.session_state.session_podcasts = []
+if "audio_exists" not in st.session_state:
+    st.session_state.audio_exists = {}
 if "groq_api_key" not in st.session_state:
     st.session_state.groq_api_key = ""
 if "api_key_validated" not in st.session_state:
@@ -272,8 +612,8 @@ if "api_key_validated" not in st.session_state:
 if "validation_message" not in st.session_state:
     st.session_state.validation_message = ""
 
-# Initialize database
-init_database()
+# Initialize database (once per server process, not on every rerun)
+ensure_database()
 
 # -------------------------------
 # Environment setup
@@ -338,6 +678,135 @@ def show_auth_page():
                     else:
                         st.error("❌ " + message)
 
+# -------------------------------
+# Main App Tabs
+# -------------------------------
+def audio_file_exists(path):
+    """os.path.exists() memoized in session state; reset on save and logout"""
+    cache = st.session_state.audio_exists
+    if path not in cache:
+        cache[path] = os.path.exists(path)
+    return cache[path]
+
+# Not a fragment: generating a podcast must rerun the whole app so the
+# history tab picks up the new entry in the same run.
+def render_generator_tab(llm, client, username, user_id):
+    st.header("Generate Podcasts from Notes or Textbooks")
+
+    uploaded_file = st.file_uploader("📄 Upload a PDF or TXT file", type=["pdf", "txt"])
+
+    if uploaded_file:
+        # UploadedFile is an in-memory buffer, so sniff a prefix of it
+        # without moving the stream position
+        mime = detect_mime_type(uploaded_file.getvalue()[:2048], uploaded_file.name)
+        if mime not in ["application/pdf", "text/plain"]:
+            st.error("❌ Invalid file type. Please upload a valid PDF or TXT file.")
+            st.stop()
+
+    if uploaded_file:
+        file_size_mb = uploaded_file.size / (1024 * 1024)
+        if file_size_mb > 10:
+            st.error("❌ File too large! Please upload a file smaller than 10 MB.")
+            st.stop()
+
+        st.success("✅ File uploaded successfully!")
+
+        if st.button("🚀 Generate Podcast"):
+            with st.spinner("🧠 Summarizing and generating your podcast..."):
+                try:
+                    # Parse straight from the in-memory upload; no temp file needed
+                    file_bytes = uploaded_file.getvalue()
+                    file_hash = hashlib.sha256(file_bytes).hexdigest()
+                    summary = summarize_document(file_hash, uploaded_file.name, file_bytes, llm)
+
+                    st.subheader("🧾 Summary:")
+                    st.write(summary)
+
+                    # Generate unique filename
+                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                    audio_filename = f"{username}_{timestamp}.wav"
+
+                    # Create audio directory if it doesn't exist
+                    os.makedirs("audio_files", exist_ok=True)
+                    audio_path = os.path.join("audio_files", audio_filename)
+
+                    speech_text = clean_for_tts(summary)
+                    try:
+                        audio_path = synthesize_podcast(client, speech_text, audio_path, voice="Celeste-PlayAI")
+                    except Exception:
+                        st.warning("⚠️ Groq TTS limit reached — using gTTS fallback.")
+                        tts = gTTS(speech_text)
+                        audio_path = audio_path.replace(".wav", ".mp3")
+                        tts.save(audio_path)
+
+                    st.audio(audio_path)
+                    st.success("🎧 Podcast generated successfully!")
+
+                    # Save to database
+                    save_podcast(user_id, uploaded_file.name, summary, audio_path)
+
+                    # Add to session
+                    new_entry = {"title": uploaded_file.name, "summary": summary, "audio": audio_path}
+                    st.session_state.session_podcasts.append(new_entry)
+                    st.session_state.audio_exists = {}
+
+                except Exception as e:
+                    st.error(f"❌ Error generating podcast: {str(e)}")
+                    with st.expander("🔧 Debug details (temporary)"):
+                        st.code(traceback.format_exc())
+
+    # Display current session podcasts
+    if st.session_state.session_podcasts:
+        st.subheader("📚 Podcasts Generated This Session")
+        for i, pod in enumerate(st.session_state.session_podcasts):
+            with st.expander(f"🎧 {i+1}. {pod['title']}"):
+                st.write(pod["summary"])
+                if audio_file_exists(pod["audio"]):
+                    st.audio(pod["audio"])
+
+# Fragment: chatting only reruns the chat tab, not the generator/history
+@st.fragment
+def render_chat_tab(agent):
+    st.header("🤖 Research Assistant")
+    st.markdown("**🧩 Active Tools:** Wikipedia, ArXiv, Web Search")
+
+    for msg in st.session_state.mes:
+        st.chat_message(msg["role"]).write(msg["content"])
+
+    st.markdown("<div style='height: 100px;'></div>", unsafe_allow_html=True)
+    prompt = st.chat_input("Ask me anything about your topic...")
+
+    if prompt:
+        st.session_state.mes.append({"role": "user", "content": prompt})
+        st.chat_message("user").write(prompt)
+
+        with st.spinner("🔍 Researching across tools... please wait"):
+            try:
+                response = agent.invoke({"messages": [("user", prompt)]})
+                output_text = response["messages"][-1].content
+            except Exception as e:
+                output_text = f"Sorry, I encountered an error: {str(e)}"
+
+        st.chat_message("ai").write(output_text)
+        st.session_state.mes.append({"role": "ai", "content": output_text})
+
+def render_history_tab(user_id):
+    st.header("🗂️ Podcast History")
+
+    user_history = get_user_podcasts(user_id)
+
+    if user_history:
+        for i, pod in enumerate(user_history):
+            with st.expander(f"🎧 {i+1}. {pod['title']} - {pod['created_at'][:10]}"):
+                st.write("**Summary:**")
+                st.write(pod["summary"])
+                if audio_file_exists(pod["audio"]):
+                    st.audio(pod["audio"])
+                else:
+                    st.warning("⚠️ Audio file not found")
+    else:
+        st.info("ℹ️ No podcast history yet. Generate one from the 'Podcast Generator' tab!")
+
 # -------------------------------
 # Main App
 # -------------------------------
@@ -385,6 +854,7 @@ def show_main_app():
         st.session_state.groq_api_key = ""
         st.session_state.api_key_validated = False
         st.session_state.validation_message = ""
+        st.session_state.audio_exists = {}
         st.rerun()
     
     # Main content area
@@ -409,19 +879,10 @@ def show_main_app():
     GROQ_KEY = st.session_state.groq_api_key
     
     try:
-        llm = ChatGroq(
-            model="openai/gpt-oss-120b",
-            groq_api_key=GROQ_KEY,
-            streaming=True
-        )
-        client = Groq(api_key=GROQ_KEY)
-        
-        api_wiki = WikipediaAPIWrapper(top_k_results=1, doc_content_chars_max=250)
-        wiki = WikipediaQueryRun(api_wrapper=api_wiki)
-        api_arxiv = ArxivAPIWrapper(top_k_results=1, doc_content_chars_max=250)
-        arxiv = ArxivQueryRun(api_wrapper=api_arxiv)
-        search = DuckDuckGoSearchRun(name="search")
-        tools = [wiki, arxiv, search]
+        services = get_services(GROQ_KEY)
+        llm = services["llm"]
+        client = services["client"]
+        agent = services["agent"]
     except Exception as e:
         st.error(f"❌ Error initializing services: {str(e)}")
         st.session_state.api_key_validated = False
@@ -433,170 +894,15 @@ def show_main_app():
 
     # ---------------- TAB 1: Podcast Generator ----------------
     with tab1:
-        st.header("Generate Podcasts from Notes or Textbooks")
-
-        uploaded_file = st.file_uploader("📄 Upload a PDF or TXT file", type=["pdf", "txt"])
-
-        if uploaded_file:
-            file_head = uploaded_file.read(2048)
-            uploaded_file.seek(0)
-            mime = detect_mime_type(file_head, uploaded_file.name)
-            if mime not in ["application/pdf", "text/plain"]:
-                st.error("❌ Invalid file type. Please upload a valid PDF or TXT file.")
-                st.stop()
-
-        if uploaded_file:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(uploaded_file.name)[1]) as tmp:
-                tmp.write(uploaded_file.read())
-                file_path = tmp.name
-            st.success("✅ File uploaded successfully!")
-
-            file_size_mb = os.path.getsize(file_path) / (1024 * 1024)
-            if file_size_mb > 10:
-                st.error("❌ File too large! Please upload a file smaller than 10 MB.")
-                os.unlink(file_path)
-                st.stop()
-
-            if st.button("🚀 Generate Podcast"):
-                with st.spinner("🧠 Summarizing and generating your podcast..."):
-                    try:
-                        # Load text
-                        if uploaded_file.name.endswith(".pdf"):
-                            loader = PyPDFLoader(file_path)
-                            docs = loader.load()
-                            text_content = " ".join([d.page_content for d in docs])
-                        else:
-                            with open(file_path, "r", encoding="utf-8") as f:
-                                text_content = f.read()
-                            docs = [{"page_content": text_content}]
-
-                        # Sanitize: convert typographic punctuation (em dashes,
-                        # smart quotes, etc. common in PDFs/resumes) and strip
-                        # any other non-ASCII characters that could crash
-                        # downstream libraries.
-                        text_content = sanitize_text(text_content)
-
-                        # Split text into chunks (always split the sanitized
-                        # text_content, so PDFs and TXT files are treated
-                        # consistently and no unsanitized text slips through)
-                        splitter = RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=200)
-                        chunks = splitter.create_documents([text_content])
-
-                        word_count = len(text_content.split())
-
-                        if word_count < 5000:
-                            summarize_chain = load_summarize_chain(llm, chain_type="stuff", verbose=False)
-                        else:
-                            summarize_chain = load_summarize_chain(llm, chain_type="map_reduce", verbose=False)
-
-                        summary = summarize_chain.run(chunks)
-                        summary = sanitize_text(summary)
-
-                        st.subheader("🧾 Summary:")
-                        st.write(summary)
-
-                        # Generate unique filename
-                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                        audio_filename = f"{username}_{timestamp}.wav"
-                        
-                        # Create audio directory if it doesn't exist
-                        os.makedirs("audio_files", exist_ok=True)
-                        audio_path = os.path.join("audio_files", audio_filename)
-
-                        def generate_podcast_audio(text, output_path, voice="Celeste-PlayAI"):
-                            model = "playai-tts"
-                            response = client.audio.speech.create(
-                                model=model,
-                                voice=voice,
-                                input=text,
-                                response_format="wav"
-                            )
-                            response.write_to_file(output_path)
-                            return output_path
-
-                        try:
-                            audio_path = generate_podcast_audio(summary, audio_path, voice="Celeste-PlayAI")
-                        except Exception:
-                            st.warning("⚠️ Groq TTS limit reached — using gTTS fallback.")
-                            tts = gTTS(summary)
-                            audio_path = audio_path.replace(".wav", ".mp3")
-                            tts.save(audio_path)
-
-                        st.audio(audio_path)
-                        st.success("🎧 Podcast generated successfully!")
-
-                        # Save to database
-                        save_podcast(user_id, uploaded_file.name, summary, audio_path)
-                        
-                        # Add to session
-                        new_entry = {"title": uploaded_file.name, "summary": summary, "audio": audio_path}
-                        st.session_state.session_podcasts.append(new_entry)
-
-                    except Exception as e:
-                        st.error(f"❌ Error generating podcast: {str(e)}")
-                        with st.expander("🔧 Debug details (temporary)"):
-                            st.code(traceback.format_exc())
-                    finally:
-                        # Clean up temp file
-                        if os.path.exists(file_path):
-                            os.unlink(file_path)
-
-        # Display current session podcasts
-        if st.session_state.session_podcasts:
-            st.subheader("📚 Podcasts Generated This Session")
-            for i, pod in enumerate(st.session_state.session_podcasts):
-                with st.expander(f"🎧 {i+1}. {pod['title']}"):
-                    st.write(pod["summary"])
-                    if os.path.exists(pod["audio"]):
-                        st.audio(pod["audio"])
+        render_generator_tab(llm, client, username, user_id)
 
     # ---------------- TAB 2: Research Assistant ----------------
     with tab2:
-        st.header("🤖 Research Assistant")
-        st.markdown("**🧩 Active Tools:** Wikipedia, ArXiv, Web Search")
-
-        for msg in st.session_state.mes:
-            st.chat_message(msg["role"]).write(msg["content"])
-
-        st.markdown("<div style='height: 100px;'></div>", unsafe_allow_html=True)
-        prompt = st.chat_input("Ask me anything about your topic...")
-
-        if prompt:
-            st.session_state.mes.append({"role": "user", "content": prompt})
-            st.chat_message("user").write(prompt)
-
-            agent = create_react_agent(
-            model=llm,
-            tools=tools
-            )
-
-            with st.spinner("🔍 Researching across tools... please wait"):
-                try:
-                    response = agent.invoke({"messages": [("user", prompt)]})
-                    output_text = response["messages"][-1].content
-                except Exception as e:
-                    output_text = f"Sorry, I encountered an error: {str(e)}"
-
-            st.chat_message("ai").write(output_text)
-            st.session_state.mes.append({"role": "ai", "content": output_text})
+        render_chat_tab(agent)
 
     # ---------------- TAB 3: Podcast History ----------------
     with tab3:
-        st.header("🗂️ Podcast History")
-
-        user_history = get_user_podcasts(user_id)
-
-        if user_history:
-            for i, pod in enumerate(user_history):
-                with st.expander(f"🎧 {i+1}. {pod['title']} - {pod['created_at'][:10]}"):
-                    st.write("**Summary:**")
-                    st.write(pod["summary"])
-                    if os.path.exists(pod["audio"]):
-                        st.audio(pod["audio"])
-                    else:
-                        st.warning("⚠️ Audio file not found")
-        else:
-            st.info("ℹ️ No podcast history yet. Generate one from the 'Podcast Generator' tab!")
+        render_history_tab(user_id)
 
 # -------------------------------
 # Conditional Rendering